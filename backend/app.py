@@ -1,30 +1,75 @@
 import os
+import re
+import tempfile
 import requests
 import logging
+import queue
+import threading
 import time
+import uuid
+from urllib.parse import urlencode
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-from PIL import Image, ImageEnhance, ImageFilter
-import pytesseract
+from flask_caching import Cache
+from PIL import Image
+import cv2
+from tesserocr import PyTessBaseAPI
 import io
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import pandas as pd
 import numpy as np
+from pyarrow import feather
 
 # ---------------- CONFIG ----------------
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024 # Reject uploads over 10 MB with a 413
 # Ensure CORS allows requests from your React frontend
 CORS(app, resources={r"/*": {"origins": ["http://localhost:3000", "*"]}})
 
+# In-process cache for Spoonacular responses, so repeated identical lookups skip the network
+cache = Cache(app, config={'CACHE_TYPE': 'SimpleCache', 'CACHE_DEFAULT_TIMEOUT': 3600})
+SPOONACULAR_CACHE_TIMEOUT = 86400 # Seconds; ingredient and recipe details rarely change
+
 # IMPORTANT: Ensure this key is valid and has not exceeded its quota.
 API_KEY = os.getenv("SPOONACULAR_API_KEY", "4bab931c1e9b4b71880d69188f321e55")
 
+# --- HTTP CONFIG ---
+# A shared session keeps TCP/TLS connections to Spoonacular alive between requests.
+# Transient failures (connection errors, rate limiting, 5xx) are retried by urllib3
+# with exponential backoff on the same connection pool.
+REQUEST_TIMEOUT = 5 # Seconds
+SPOONACULAR_RETRY = Retry(
+    total=3,
+    backoff_factor=1,
+    status_forcelist=[429, 500, 502, 503, 504],
+    allowed_methods=['GET'],
+    raise_on_status=False, # Hand back the last response so raise_for_status() keeps its status code
+    # Ignore Retry-After: Spoonacular can ask for arbitrarily long waits on 429, which would
+    # block a request thread far past REQUEST_TIMEOUT. Use the bounded backoff instead.
+    respect_retry_after_header=False,
+)
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=16, max_retries=SPOONACULAR_RETRY))
+
+# Worker pool for resolving several nutrition lookups against the API at once
+LOOKUP_EXECUTOR = ThreadPoolExecutor(max_workers=8)
+MAX_BATCH_LOOKUPS = 20 # Largest list accepted by /lookup_nutrition_batch
+
 # --- LOCAL DATASET CONFIG ---
 # WARNING: This path might need adjustment based on where you run the script.
 LOCAL_JSON_FILE = r'C:\Users\bivin\Favorites\Desktop\sem7\fsd\ocr-app\frontend\src\csvjson.json' 
+LOCAL_FEATHER_FILE = 'dataset.feather' # Parsed dataset cache, relative to this script
 LOCAL_DATASET = None # Placeholder for the combined Pandas DataFrame
+NAME_INDEX = {} # Lowercased food_name -> row position in LOCAL_DATASET
+NAMES_SORTED = None # Sorted lowercased food names, for prefix search
+NAMES_ORDER = None # Row positions in LOCAL_DATASET matching NAMES_SORTED
+NUTRIENT_MATRIX = None # float32 array of shape (records, len(MATRIX_COLUMNS))
+FOOD_NAMES = [] # food_name per row, aligned with NUTRIENT_MATRIX
 
 # Mapping for the new JSON keys to match the standard required by the frontend
 JSON_KEY_MAP = {
@@ -48,45 +93,125 @@ ALL_EXPECTED_COLUMNS = [
     "calcium", "iron", "folate", "vitamin_c", "saturatedFat", 
     "cholesterol", "sodium", "fiber", "sugar"
 ]
+NUTRIENT_COLUMNS = [col for col in ALL_EXPECTED_COLUMNS if col not in ("food_name", "calories")]
+MATRIX_COLUMNS = ["calories"] + NUTRIENT_COLUMNS # Column order of NUTRIENT_MATRIX
+
+# Activity level (1-5) -> TDEE multiplier; index 0 is the default for unknown levels.
+# The tuple serves single lookups, the array the vectorized batch endpoint.
+ACTIVITY_MULTIPLIERS = (1.2, 1.2, 1.375, 1.55, 1.725, 1.9)
+ACTIVITY_MULTIPLIER_LUT = np.array(ACTIVITY_MULTIPLIERS)
+ACTIVITY_LEVELS = range(1, len(ACTIVITY_MULTIPLIERS))
+
+# Mifflin-St Jeor BMR offset by gender; anything other than 'male' uses the female offset
+GENDER_BMR_OFFSET = {'male': 5, 'female': -161}
+DEFAULT_BMR_OFFSET = GENDER_BMR_OFFSET['female']
 
 
-try:
-    pytesseract.get_tesseract_version()
-except pytesseract.TesseractNotFoundError:
-    pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+# Longest image side (in pixels) passed to Tesseract; larger uploads are downscaled
+OCR_MAX_DIMENSION = 2000
+
+# Default Windows install location, used if Tesseract can't find its data on its own
+TESSDATA_FALLBACK_PATH = r'C:\Program Files\Tesseract-OCR\tessdata'
+OCR_WORKERS = 4 # OCR jobs that can run at the same time, each with its own engine
+OCR_PLACEHOLDER_TEXT = 'rice, tomato, milk, sugar'
+OCR_JOB_TTL = 600 # Seconds an OCR job is kept before it is discarded, polled or not
+OCR_MAX_PENDING_JOBS = 32 # Unfinished OCR jobs allowed before /ocr answers 503
 
 # ---------------- DATA LOADING UTILITIES ----------------
 
+def parse_local_json(json_path):
+    """Parses the local JSON file into a DataFrame with the standard columns and compact dtypes."""
+    json_df = pd.read_json(json_path)
+    
+    json_df = json_df.replace('', 0, regex=False)
+    
+    json_df.rename(columns=JSON_KEY_MAP, inplace=True)
+    
+    for col in ALL_EXPECTED_COLUMNS:
+        if col not in json_df.columns:
+            json_df[col] = 0.0
+            
+    json_df = json_df[ALL_EXPECTED_COLUMNS].copy()
+
+    # Compact dtypes: nutrient magnitudes fit comfortably in float32, and a
+    # categorical name column stores each distinct string once
+    json_df[NUTRIENT_COLUMNS] = (
+        json_df[NUTRIENT_COLUMNS].apply(pd.to_numeric, errors='coerce').fillna(0.0).astype(np.float32)
+    )
+    json_df['food_name'] = json_df['food_name'].astype('category')
+    json_df['calories'] = json_df['calories'].round(0).astype(int)
+    return json_df.reset_index(drop=True)
+
+
+def write_feather_cache(df, feather_path):
+    """
+    Writes the parsed dataset to the Feather cache atomically: the file is built
+    under a temporary name in the same directory and then renamed into place, so a
+    crash or a concurrent writer can never leave a truncated cache behind.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(feather_path), suffix='.feather.tmp')
+    os.close(fd)
+    try:
+        # Uncompressed so the next startup can memory-map it without decompressing
+        feather.write_feather(df, tmp_path, compression='uncompressed')
+        os.replace(tmp_path, feather_path)
+    except Exception as e:
+        logger.warning(f"Could not write Feather cache '{feather_path}': {e}")
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
 def load_local_dataset():
-    """Loads data from the local JSON file only."""
-    global LOCAL_DATASET
+    """
+    Loads the local dataset, preferring the Feather cache next to this script.
+    The JSON file is only parsed if the cache is missing or older than it,
+    in which case the cache is rewritten for the next startup.
+    """
+    global LOCAL_DATASET, NAME_INDEX, NAMES_SORTED, NAMES_ORDER, NUTRIENT_MATRIX, FOOD_NAMES
     
     try:
+        script_dir = os.path.dirname(os.path.abspath(__file__))
         if os.path.isabs(LOCAL_JSON_FILE):
             json_path = LOCAL_JSON_FILE
         else:
-            script_dir = os.path.dirname(os.path.abspath(__file__))
             json_path = os.path.join(script_dir, LOCAL_JSON_FILE)
-            
-        logger.info(f"Attempting to load local JSON from: {json_path}")
+        feather_path = os.path.join(script_dir, LOCAL_FEATHER_FILE)
         
-        json_df = pd.read_json(json_path)
+        LOCAL_DATASET = None
+        json_mtime = os.path.getmtime(json_path) if os.path.exists(json_path) else 0
+        if os.path.exists(feather_path) and os.path.getmtime(feather_path) >= json_mtime:
+            logger.info(f"Loading local dataset from Feather cache: {feather_path}")
+            try:
+                # Memory-mapped Arrow IPC: no JSON parsing or dtype conversion on startup
+                LOCAL_DATASET = feather.read_table(feather_path, memory_map=True).to_pandas()
+            except Exception as e:
+                logger.warning(f"Feather cache '{feather_path}' is unreadable, rebuilding it from JSON. Details: {e}")
+
+        if LOCAL_DATASET is None:
+            logger.info(f"Attempting to load local JSON from: {json_path}")
+            LOCAL_DATASET = parse_local_json(json_path)
+            write_feather_cache(LOCAL_DATASET, feather_path)
         
-        json_df = json_df.replace('', 0, regex=False)
+        # Precompute the normalized name once so lookups don't re-lower the column per request
+        LOCAL_DATASET['_name_lc'] = LOCAL_DATASET['food_name'].astype(str).str.strip().str.lower()
         
-        json_df.rename(columns=JSON_KEY_MAP, inplace=True)
+        # Keep the first row for duplicate names, matching the old iloc[0] behaviour
+        NAME_INDEX = {}
+        for i, name in enumerate(LOCAL_DATASET['_name_lc'].values):
+            NAME_INDEX.setdefault(name, i)
         
-        for col in ALL_EXPECTED_COLUMNS:
-            if col not in json_df.columns:
-                json_df[col] = 0.0
-                
-        json_df = json_df[ALL_EXPECTED_COLUMNS]
-
-        LOCAL_DATASET = json_df
+        # Sorted copy of the names so prefix lookups are a binary search
+        names = LOCAL_DATASET['_name_lc'].values.astype(str)
+        NAMES_ORDER = np.argsort(names, kind='stable')
+        NAMES_SORTED = names[NAMES_ORDER]
         
-        LOCAL_DATASET['calories'] = LOCAL_DATASET['calories'].round(0).astype(int)
+        # Contiguous row-major copy of the numbers so a hit is one array slice, not a pandas row
+        NUTRIENT_MATRIX = LOCAL_DATASET[MATRIX_COLUMNS].to_numpy(dtype=np.float32, copy=True)
+        FOOD_NAMES = LOCAL_DATASET['food_name'].astype(str).tolist()
         
-        logger.info(f"Successfully loaded JSON dataset from {json_path} with {len(LOCAL_DATASET)} total records.")
+        logger.info(f"Successfully loaded local dataset with {len(LOCAL_DATASET)} total records.")
         
     except FileNotFoundError:
         logger.error(f"FATAL ERROR: Local JSON file '{json_path}' not found. Please verify the absolute path, including the filename.")
@@ -94,37 +219,50 @@ def load_local_dataset():
         logger.error(f"FATAL ERROR: Failed to parse local JSON dataset '{json_path}'. Check JSON syntax (must be wrapped in [ ]). Details: {e}")
 
 
+def find_prefix_match(query):
+    """Returns the first dataset row whose lowercased name starts with query, or None."""
+    if NAMES_SORTED is None or not query:
+        return None
+    lo = np.searchsorted(NAMES_SORTED, query, side='left')
+    hi = np.searchsorted(NAMES_SORTED, query + '\U0010ffff', side='left')
+    if lo == hi:
+        return None
+    # Prefer the earliest row in file order, like the old boolean-mask search
+    return int(NAMES_ORDER[lo:hi].min())
+
+
 # ---------------- CORE UTILITIES ----------------
 
-def find_nutrient_amount(nutrients_list, name):
-    """Helper to find a specific nutrient amount and return it as a float."""
+def build_nutrient_map(nutrients_list):
+    """Helper to map lowercased nutrient names to their amounts, rounded to 1 decimal place."""
+    nutrient_map = {}
     for n in nutrients_list:
-        if n.get("name", "").lower() == name.lower():
-            # Return amount rounded to 1 decimal place, or 0 if missing
-            return round(n.get("amount", 0.0), 1)
-    return 0.0
+        # First occurrence wins, in case Spoonacular lists a nutrient twice
+        nutrient_map.setdefault(n.get("name", "").lower(), round(n.get("amount", 0.0), 1))
+    return nutrient_map
 
 def preprocess_image(image):
-    """Basic image preprocessing for OCR."""
-    image = image.convert('L')
-    enhancer = ImageEnhance.Contrast(image)
-    image = enhancer.enhance(2.0)
-    image = image.filter(ImageFilter.ModeFilter(size=3))
-    return image
+    """Basic image preprocessing for OCR: grayscale, downscale, denoise and binarize."""
+    arr = np.asarray(image.convert('L'))
+
+    # Large phone photos cost Tesseract time per pixel without improving accuracy
+    height, width = arr.shape
+    scale = OCR_MAX_DIMENSION / max(height, width)
+    if scale < 1:
+        # Clamp to 1 px so very thin images don't collapse to a zero-sized dimension
+        new_size = (max(1, int(width * scale)), max(1, int(height * scale)))
+        arr = cv2.resize(arr, new_size, interpolation=cv2.INTER_AREA)
+
+    arr = cv2.medianBlur(arr, 3)
+    # Local thresholding copes with uneven lighting and already maximizes contrast
+    arr = cv2.adaptiveThreshold(arr, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 10)
+    return Image.fromarray(arr)
     
 # --- NEW/UPDATED INGREDIENT CLEANING UTILITY ---
 
-def clean_ingredients(ingredients_string):
-    """
-    Cleans up common OCR misspellings and prepares a comma-separated list
-    for the Spoonacular API's includeIngredients parameter.
-    """
-    if not ingredients_string:
-        return ""
-        
-    # Dictionary of common OCR errors -> correct spelling
-    correction_map = {
-        # --- General OCR spelling mistakes ---
+# Dictionary of common OCR errors -> correct spelling
+OCR_CORRECTION_MAP = {
+    # --- General OCR spelling mistakes ---
     "teh": "the",
     "reciept": "receipt",
     "amout": "amount",
@@ -150,10 +288,27 @@ def clean_ingredients(ingredients_string):
     "oder": "order",
     "detils": "details",
     "timw": "time"
+}
 
+# All corrections compiled into one alternation, matched only as whole
+# whitespace-separated words, so an item is fixed in a single regex pass.
+# Longest words first so a misspelling is never shadowed by its own prefix.
+OCR_CORRECTION_PATTERN = re.compile(
+    r'(?<!\S)(' + '|'.join(map(re.escape, sorted(OCR_CORRECTION_MAP, key=len, reverse=True))) + r')(?!\S)'
+)
+
+def correct_ocr_word(match):
+    """Regex substitution callback returning the correction for a matched OCR word."""
+    return OCR_CORRECTION_MAP[match.group(1)]
+
+def clean_ingredients(ingredients_string):
+    """
+    Cleans up common OCR misspellings and prepares a comma-separated list
+    for the Spoonacular API's includeIngredients parameter.
+    """
+    if not ingredients_string:
+        return ""
         
-    }
-    
     # 1. Standardize and split by common delimiters
     raw_list = ingredients_string.lower().replace("\n", ",").split(',')
     
@@ -165,11 +320,233 @@ def clean_ingredients(ingredients_string):
             
         # Perform single word corrections within the item if necessary
         # This handles cases like 'cricken breast' -> 'chicken breast'
-        corrected_item = " ".join([correction_map.get(word, word) for word in item.split()])
+        corrected_item = OCR_CORRECTION_PATTERN.sub(correct_ocr_word, " ".join(item.split()))
         cleaned_list.append(corrected_item)
             
-    # Return the clean, comma-separated list, removing duplicates with set().
-    return ",".join(list(set(cleaned_list)))
+    # Return the clean, comma-separated list, removing duplicates while keeping the
+    # original order, so the same ingredients always produce the same (cacheable) query.
+    return ",".join(dict.fromkeys(cleaned_list))
+
+
+# ---------------- SPOONACULAR CLIENT ----------------
+
+SPOONACULAR_BASE_URL = "https://api.spoonacular.com"
+
+def spoonacular_get_json(path, params):
+    """
+    GETs a Spoonacular endpoint and returns the decoded JSON; retries are handled by SESSION.
+    Query parameters are percent-encoded with urlencode, so user input containing
+    spaces, commas or '&' can't break or alter the query string.
+    """
+    url = f"{SPOONACULAR_BASE_URL}{path}?" + urlencode(params)
+    # The key goes in a header, so it never appears in URLs that end up in logs or error messages
+    response = SESSION.get(url, headers={"x-api-key": API_KEY}, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    return response.json()
+
+
+@cache.memoize(timeout=SPOONACULAR_CACHE_TIMEOUT)
+def spoonacular_ingredient_search(food_name):
+    """Searches Spoonacular for the best matching ingredient for food_name."""
+    return spoonacular_get_json("/food/ingredients/search", {"query": food_name, "number": 1})
+
+
+@cache.memoize(timeout=SPOONACULAR_CACHE_TIMEOUT)
+def spoonacular_ingredient_info(ingredient_id):
+    """Fetches nutrition for a Spoonacular ingredient ID, per 100 grams."""
+    return spoonacular_get_json(
+        f"/food/ingredients/{int(ingredient_id)}/information", {"amount": 100, "unit": "grams"}
+    )
+
+
+@cache.memoize()
+def spoonacular_recipe_search(cleaned_query, diet, exclude_ingredients):
+    """Runs a complexSearch for recipes using the given ingredients and restrictions."""
+    # Use 'includeIngredients' instead of 'query' and include 'sort' for better results
+    params = {
+        "includeIngredients": cleaned_query,
+        "number": 8,
+        "diet": diet,
+        "excludeIngredients": exclude_ingredients,
+        "addRecipeInformation": "true",
+        "sort": "min-missing-ingredients", # Prioritizes recipes that use the most of our ingredients
+    }
+    logger.info(f"Spoonacular complexSearch params: {params}") 
+    return spoonacular_get_json("/recipes/complexSearch", params)
+
+
+@cache.memoize(timeout=SPOONACULAR_CACHE_TIMEOUT)
+def spoonacular_recipe_info(recipe_id):
+    """Fetches full recipe information, including nutrition, for a Spoonacular recipe ID."""
+    return spoonacular_get_json(f"/recipes/{int(recipe_id)}/information", {"includeNutrition": "true"})
+
+
+# ---------------- NUTRITION LOOKUP HELPERS ----------------
+
+def lookup_local_nutrition(food_name):
+    """Returns nutrition data for food_name from the local dataset, or None if not found."""
+    if LOCAL_DATASET is None:
+        logger.warning(f"Local dataset is None. Skipping local lookup for: '{food_name}'. Attempting API fallback. Check the console for the FATAL ERROR log.")
+        return None
+
+    # Search 1: Strict exact match (case-insensitive, trimming whitespace) via the name index
+    idx = NAME_INDEX.get(food_name.lower())
+
+    if idx is None:
+        # Search 2: Prefix match on the sorted names (binary search)
+        idx = find_prefix_match(food_name.lower())
+
+    if idx is None:
+        # Search 3: Broad substring match (in case user types a partial name)
+        matches = np.flatnonzero(
+            LOCAL_DATASET['_name_lc'].str.contains(food_name.lower(), regex=False, na=False).values
+        )
+        if matches.size:
+            idx = int(matches[0])
+
+    if idx is None:
+        logger.info(f"Local dataset lookup failed for: '{food_name}'. Attempting API fallback.")
+        return None
+
+    # Match found! Return data from JSON.
+    row = NUTRIENT_MATRIX[idx]
+    
+    # Format local data to match API response structure expected by the frontend.
+    # Nutrients are stored as float32; str() gives each value's shortest float32 repr,
+    # so the JSON values come back exactly (2.3, not 2.2999999) without cutting decimals
+    nutrition_data = dict(zip(MATRIX_COLUMNS, [float(str(value)) for value in row]))
+    nutrition_data['calories'] = int(row[0])
+    nutrition_data['food_name'] = FOOD_NAMES[idx]
+    
+    logger.info(f"Returning LOCAL nutrition data for: {food_name} (Source: JSON)")
+    return nutrition_data
+
+
+def lookup_api_nutrition(food_name):
+    """
+    Looks up nutrition for food_name via Spoonacular.
+    Returns a (payload, status_code) tuple; API errors are turned into error payloads.
+    """
+    try:
+        # Step 1: Search for ingredient ID
+        response_data = spoonacular_ingredient_search(food_name)
+
+        if not response_data or not response_data.get('results') or not response_data['results']:
+            # This is the final error message if neither local nor API provides results.
+            return {"error": f"Food item '{food_name}' not found locally or via API."}, 404
+        
+        ingredient_id = response_data['results'][0]['id']
+        
+        # Step 2: Get Nutrition by Ingredient ID (defaulting to 100 grams for consistency)
+        info_data = spoonacular_ingredient_info(ingredient_id)
+        
+        nutrients_list = info_data.get("nutrition", {}).get("nutrients", [])
+
+        if not nutrients_list:
+            return {"error": f"Found '{food_name}' but no detailed nutrition data available."}, 404
+
+        # Step 3: Map nutrients to React-friendly structure
+        nm = build_nutrient_map(nutrients_list)
+        nutrition_data = {
+            # MACROS
+            "calories": int(nm.get("calories", 0.0)),
+            "protein": nm.get("protein", 0.0),
+            "carbohydrates": nm.get("carbohydrates", 0.0),
+            "fat": nm.get("fat", 0.0),
+            
+            # MICRONUTRIENTS/SECONDARY MACROS
+            "calcium": nm.get("calcium", 0.0),
+            "iron": nm.get("iron", 0.0),
+            "folate": nm.get("folate", 0.0),
+            "vitamin_c": nm.get("vitamin c", 0.0),
+            "saturatedFat": nm.get("saturated fat", 0.0),
+            "cholesterol": nm.get("cholesterol", 0.0),
+            "sodium": nm.get("sodium", 0.0),
+            "fiber": nm.get("fiber", 0.0),
+            "sugar": nm.get("sugar", 0.0),
+        }
+        
+        # Add the original food name for the front end log
+        nutrition_data['food_name'] = info_data.get('name', food_name)
+        
+        logger.info(f"Returning API nutrition data for: {food_name}")
+        return nutrition_data, 200
+
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Spoonacular API call failed during lookup: {str(e)}")
+        # Check if e has a response object before accessing status_code
+        status_code = getattr(e.response, 'status_code', 500)
+        if status_code in [401, 402, 403]:
+            return {"error": "Spoonacular API Key Invalid or Quota Exceeded. Please check your key."}, status_code
+        return {"error": f"API Connection Error: {e}"}, 500
+    except Exception as e:
+        logger.error(f"Error during nutrition lookup: {str(e)}")
+        return {'error': f'Internal server error: {str(e)}'}, 500
+
+
+# ---------------- OCR WORKERS ----------------
+
+def create_tess_api():
+    """Creates an English Tesseract engine, falling back to the default Windows tessdata path."""
+    try:
+        return PyTessBaseAPI(lang='eng')
+    except RuntimeError:
+        return PyTessBaseAPI(path=TESSDATA_FALLBACK_PATH, lang='eng')
+
+def build_ocr_engines():
+    """
+    Preloads one Tesseract engine per OCR worker. PyTessBaseAPI is not thread-safe,
+    so each job checks an engine out of the returned queue exclusively. If Tesseract
+    can't be loaded, the error is logged and OCR stays disabled, but the rest of
+    the API keeps working.
+    """
+    engines = queue.Queue()
+    # Under the debug reloader the parent process only watches files; the child serves
+    if __name__ == '__main__' and os.environ.get('WERKZEUG_RUN_MAIN') != 'true':
+        return engines
+    try:
+        for _ in range(OCR_WORKERS):
+            engines.put(create_tess_api())
+    except Exception as e:
+        logger.error(f"FATAL ERROR: Could not load Tesseract; /ocr is disabled. Check the tessdata install. Details: {e}")
+    return engines
+
+OCR_ENGINES = build_ocr_engines()
+OCR_ENGINE_COUNT = OCR_ENGINES.qsize() # Engines actually loaded; 0 means OCR is unavailable
+
+def run_ocr(image_bytes):
+    """Decodes an uploaded image, runs preprocessing and Tesseract, and returns the stripped text."""
+    image_data = Image.open(io.BytesIO(image_bytes))
+
+    # For JPEGs, let the decoder produce a grayscale image at a reduced scale. PIL only
+    # shrinks while *both* sides stay at or above the requested size, so request the size
+    # preprocess_image would downscale to anyway; other formats ignore draft().
+    width, height = image_data.size
+    scale = min(1, OCR_MAX_DIMENSION / max(width, height))
+    image_data.draft('L', (max(1, int(width * scale)), max(1, int(height * scale))))
+    image_data.load()
+
+    image_data = preprocess_image(image_data)
+
+    api = OCR_ENGINES.get()
+    try:
+        api.SetImage(image_data)
+        text = api.GetUTF8Text().strip()
+    finally:
+        OCR_ENGINES.put(api)
+
+    # If OCR detects nothing, return a placeholder
+    return text or OCR_PLACEHOLDER_TEXT
+
+OCR_EXECUTOR = ThreadPoolExecutor(max_workers=max(1, OCR_ENGINE_COUNT))
+OCR_JOBS = {} # job_id -> (submitted_at, Future for the OCR text)
+OCR_JOBS_LOCK = threading.Lock()
+
+def purge_expired_ocr_jobs(now):
+    """Drops OCR jobs older than OCR_JOB_TTL, e.g. ones whose client never came back to poll."""
+    for job_id, (submitted_at, _) in list(OCR_JOBS.items()):
+        if now - submitted_at > OCR_JOB_TTL:
+            del OCR_JOBS[job_id]
 
 
 # ---------------- ENDPOINTS ----------------
@@ -179,23 +556,54 @@ def perform_ocr():
     # If no image is provided, return a placeholder for manual entry flow
     if 'image' not in request.files:
         # A placeholder is returned to show the text area, as seen in your screenshot
-        return jsonify({'text': 'rice, tomato, milk, sugar'}), 200
+        return jsonify({'text': OCR_PLACEHOLDER_TEXT}), 200
 
     image_file = request.files['image']
     if not image_file or image_file.filename == '':
         return jsonify({'error': 'Invalid or empty image file.'}), 400
 
+    if OCR_ENGINE_COUNT == 0:
+        return jsonify({'error': 'OCR is unavailable: Tesseract failed to load on the server.'}), 503
+
     try:
-        image_data = Image.open(io.BytesIO(image_file.read()))
-        image_data = preprocess_image(image_data)
-        text = pytesseract.image_to_string(image_data)
+        # Keep only the compressed upload; decoding happens on the OCR worker
+        image_bytes = image_file.stream.read()
 
-        if not text.strip():
-            # If OCR detects nothing, return a placeholder
-            return jsonify({'text': 'rice, tomato, milk, sugar'}), 200
+        with OCR_JOBS_LOCK:
+            now = time.monotonic()
+            purge_expired_ocr_jobs(now)
 
+            pending = sum(1 for _, future in OCR_JOBS.values() if not future.done())
+            if pending >= OCR_MAX_PENDING_JOBS:
+                return jsonify({'error': 'OCR service is busy. Please try again shortly.'}), 503
+
+            job_id = uuid.uuid4().hex
+            OCR_JOBS[job_id] = (now, OCR_EXECUTOR.submit(run_ocr, image_bytes))
+
+        # The frontend polls /ocr/<job_id> for the text
+        return jsonify({'job_id': job_id}), 202
+    except Exception as e:
+        logger.error(f"OCR error: {str(e)}")
+        return jsonify({'error': f'OCR failed: {str(e)}'}), 500
+
+
+@app.route('/ocr/<job_id>', methods=['GET'])
+def get_ocr_result(job_id):
+    with OCR_JOBS_LOCK:
+        job = OCR_JOBS.get(job_id)
+        if job is None:
+            return jsonify({'error': 'Unknown or expired OCR job.'}), 404
+
+        _, future = job
+        if not future.done():
+            return jsonify({'status': 'pending'}), 202
+
+        # Finished jobs are handed out once; unpolled ones expire after OCR_JOB_TTL
+        del OCR_JOBS[job_id]
+
+    try:
         # Return the raw OCR text for the user to confirm/edit in the frontend
-        return jsonify({'text': text.strip()}), 200
+        return jsonify({'status': 'done', 'text': future.result()}), 200
     except Exception as e:
         logger.error(f"OCR error: {str(e)}")
         return jsonify({'error': f'OCR failed: {str(e)}'}), 500
@@ -221,38 +629,26 @@ def get_recipes():
         if not cleaned_query:
             return jsonify({"error": "Ingredients could not be processed into a valid search query."}), 400
             
-        # 2. **CRITICAL FIX:** Use 'includeIngredients' instead of 'query'
-        # Also include 'sort' parameter for better results
-        url = (
-            f"https://api.spoonacular.com/recipes/complexSearch?includeIngredients={cleaned_query}&number=8"
-            f"&apiKey={API_KEY}"
-            f"&diet={diet}" 
-            f"&excludeIngredients={exclude_ingredients}" 
-            f"&addRecipeInformation=true" 
-            f"&sort=min-missing-ingredients" # Prioritizes recipes that use the most of our ingredients
-        )
-        
         logger.info(f"Original Ingredients: {ingredients}")
         logger.info(f"Spoonacular Query (includeIngredients): {cleaned_query}")
-        logger.info(f"Spoonacular URL: {url}") 
 
-        response = requests.get(url)
-        response.raise_for_status() 
-
-        recipes_list_raw = response.json().get('results', [])
+        # 2. Search recipes (cached per cleaned query and restrictions)
+        recipes_list_raw = spoonacular_recipe_search(cleaned_query, diet, exclude_ingredients).get('results', [])
         
-        # Process and prepare recipes for frontend
-        recipes_list = []
-        for recipe in recipes_list_raw:
-              # Complex search does not guarantee full nutrition data, but we extract what's available
-              calories = recipe.get('nutrition', {}).get('nutrients', [{}])[0].get('amount', 0) if recipe.get('nutrition') else 0
-              
-              recipes_list.append({
-                  "id": recipe['id'],
-                  "title": recipe['title'],
-                  "image": recipe.get('image'),
-                  "nutrients": {"calories": int(calories)} # Ensure calories is an integer
-              })
+        # Process and prepare recipes for frontend.
+        # Complex search does not guarantee full nutrition data, so calories are looked up
+        # by name from whatever nutrients are present and default to 0.
+        recipes_list = [
+            {
+                "id": recipe['id'],
+                "title": recipe['title'],
+                "image": recipe.get('image'),
+                "nutrients": {
+                    "calories": int(build_nutrient_map((recipe.get('nutrition') or {}).get('nutrients', [])).get("calories", 0))
+                }
+            }
+            for recipe in recipes_list_raw
+        ]
 
         return jsonify({'recipes': recipes_list}), 200
 
@@ -268,34 +664,31 @@ def get_recipes():
 def get_recipe_details(recipe_id):
     # This endpoint remains the same for fetching full details for Spoonacular IDs.
     try:
-        url = f"https://api.spoonacular.com/recipes/{recipe_id}/information?includeNutrition=true&apiKey={API_KEY}"
-        response = requests.get(url)
-        response.raise_for_status()
-
-        data = response.json()
+        data = spoonacular_recipe_info(recipe_id)
 
         # Flatten Spoonacular's nested nutrient structure
         nutrients_list = data.get("nutrition", {}).get("nutrients", [])
+        nm = build_nutrient_map(nutrients_list)
 
         recipe_nutrients = {
             # MACROS (React expects specific simple keys)
-            "calories": int(find_nutrient_amount(nutrients_list, "Calories")),
-            "protein": find_nutrient_amount(nutrients_list, "Protein"),
-            "carbohydrates": find_nutrient_amount(nutrients_list, "Carbohydrates"),
-            "fat": find_nutrient_amount(nutrients_list, "Fat"),
+            "calories": int(nm.get("calories", 0.0)),
+            "protein": nm.get("protein", 0.0),
+            "carbohydrates": nm.get("carbohydrates", 0.0),
+            "fat": nm.get("fat", 0.0),
             
             # MICRONUTRIENTS (React needs these for the micro boxes)
-            "calcium": find_nutrient_amount(nutrients_list, "Calcium"),
-            "iron": find_nutrient_amount(nutrients_list, "Iron"),
-            "folate": find_nutrient_amount(nutrients_list, "Folate"),
-            "vitamin_c": find_nutrient_amount(nutrients_list, "Vitamin C"),
+            "calcium": nm.get("calcium", 0.0),
+            "iron": nm.get("iron", 0.0),
+            "folate": nm.get("folate", 0.0),
+            "vitamin_c": nm.get("vitamin c", 0.0),
             
             # EXTRA NUTRIENTS FOR LOGGING (React needs these for the summary calculation)
-            "saturatedFat": find_nutrient_amount(nutrients_list, "Saturated Fat"),
-            "cholesterol": find_nutrient_amount(nutrients_list, "Cholesterol"),
-            "sodium": find_nutrient_amount(nutrients_list, "Sodium"),
-            "fiber": find_nutrient_amount(nutrients_list, "Fiber"),
-            "sugar": find_nutrient_amount(nutrients_list, "Sugar"),
+            "saturatedFat": nm.get("saturated fat", 0.0),
+            "cholesterol": nm.get("cholesterol", 0.0),
+            "sodium": nm.get("sodium", 0.0),
+            "fiber": nm.get("fiber", 0.0),
+            "sugar": nm.get("sugar", 0.0),
         }
         
         # Prepare ingredients list for display
@@ -333,135 +726,63 @@ def lookup_nutrition():
         if not food_name:
             return jsonify({"error": "Food name is required"}), 400
 
-        # ==========================================================
         # 1. CHECK COMBINED LOCAL DATASET
-        # ==========================================================
-        if LOCAL_DATASET is not None:
-            
-            # Search 1: Strict exact match (case-insensitive, trimming whitespace)
-            local_match = LOCAL_DATASET[
-                LOCAL_DATASET['food_name'].astype(str).str.strip().str.lower() == food_name.lower()
-            ]
-
-            if local_match.empty:
-                # Search 2: Broad substring match (in case user types a partial name)
-                local_match = LOCAL_DATASET[
-                    LOCAL_DATASET['food_name'].astype(str).str.contains(food_name, case=False, na=False)
-                ]
-
-            if not local_match.empty:
-                # Match found! Return data from JSON.
-                data = local_match.iloc[0].to_dict()
-                
-                # Format local data to match API response structure expected by the frontend
-                nutrition_data = {
-                    key: (int(data.get(key)) if key == 'calories' else float(data.get(key, 0.0))) 
-                    for key in ALL_EXPECTED_COLUMNS if key != 'food_name'
-                }
-                nutrition_data['food_name'] = data.get('food_name')
-                
-                logger.info(f"Returning LOCAL nutrition data for: {food_name} (Source: JSON)")
-                return jsonify(nutrition_data), 200
-                
-            logger.info(f"Local dataset lookup failed for: '{food_name}'. Attempting API fallback.")
-            
-        else:
-            logger.warning(f"Local dataset is None. Skipping local lookup for: '{food_name}'. Attempting API fallback. Check the console for the FATAL ERROR log.")
-        # ==========================================================
-        # END LOCAL DATASET CHECK
-        # ==========================================================
+        nutrition_data = lookup_local_nutrition(food_name)
+        if nutrition_data is not None:
+            return jsonify(nutrition_data), 200
 
+        # 2. FALLBACK TO API
+        payload, status_code = lookup_api_nutrition(food_name)
+        return jsonify(payload), status_code
 
-        # =========================================================
-        # 2. FALLBACK TO API 
-        # ==========================================================
-        
-        # Step 1: Search for ingredient ID
-        search_url = f"https://api.spoonacular.com/food/ingredients/search?query={food_name}&number=1&apiKey={API_KEY}"
-        response_data = None
-        
-        # Implementation of exponential backoff for API calls
-        max_retries = 3
-        retry_delay = 1 # Start with 1 second
-        
-        for attempt in range(max_retries):
-            try:
-                search_response = requests.get(search_url)
-                search_response.raise_for_status()
-                search_data = search_response.json()
-                response_data = search_data
-                break # Exit loop if successful
-            except requests.exceptions.RequestException as e:
-                if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
-                    retry_delay *= 2
-                else:
-                    raise # Re-raise error if last attempt failed
+    except Exception as e:
+        logger.error(f"Error during nutrition lookup: {str(e)}")
+        return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
-        if not response_data or not response_data.get('results') or not response_data['results']:
-            # This is the final error message if neither local nor API provides results.
-            return jsonify({"error": f"Food item '{food_name}' not found locally or via API."}), 404
-        
-        ingredient_id = response_data['results'][0]['id']
-        
-        # Step 2: Get Nutrition by Ingredient ID (defaulting to 100 grams for consistency)
-        info_url = f"https://api.spoonacular.com/food/ingredients/{ingredient_id}/information?amount=100&unit=grams&apiKey={API_KEY}"
-        info_data = None
-        retry_delay = 1 # Reset retry delay
-        
-        for attempt in range(max_retries):
-            try:
-                info_response = requests.get(info_url)
-                info_response.raise_for_status()
-                info_data = info_response.json()
-                break # Exit loop if successful
-            except requests.exceptions.RequestException as e:
-                if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
-                    retry_delay *= 2
-                else:
-                    raise # Re-raise error if last attempt failed
-        
-        nutrients_list = info_data.get("nutrition", {}).get("nutrients", [])
 
-        if not nutrients_list:
-            return jsonify({"error": f"Found '{food_name}' but no detailed nutrition data available."}), 404
+@app.route('/lookup_nutrition_batch', methods=['POST'])
+def lookup_nutrition_batch():
+    """
+    Looks up nutrition for a list of food names in one call.
+    Local dataset hits are served inline; the remaining names are fetched
+    from Spoonacular in parallel. Results keep the order of the input list.
+    """
+    try:
+        data = request.get_json()
+        food_names = data.get('food_names', [])
 
-        # Step 3: Map nutrients to React-friendly structure
-        nutrition_data = {
-            # MACROS
-            "calories": int(find_nutrient_amount(nutrients_list, "Calories")),
-            "protein": find_nutrient_amount(nutrients_list, "Protein"),
-            "carbohydrates": find_nutrient_amount(nutrients_list, "Carbohydrates"),
-            "fat": find_nutrient_amount(nutrients_list, "Fat"),
-            
-            # MICRONUTRIENTS/SECONDARY MACROS
-            "calcium": find_nutrient_amount(nutrients_list, "Calcium"),
-            "iron": find_nutrient_amount(nutrients_list, "Iron"),
-            "folate": find_nutrient_amount(nutrients_list, "Folate"),
-            "vitamin_c": find_nutrient_amount(nutrients_list, "Vitamin C"),
-            "saturatedFat": find_nutrient_amount(nutrients_list, "Saturated Fat"),
-            "cholesterol": find_nutrient_amount(nutrients_list, "Cholesterol"),
-            "sodium": find_nutrient_amount(nutrients_list, "Sodium"),
-            "fiber": find_nutrient_amount(nutrients_list, "Fiber"),
-            "sugar": find_nutrient_amount(nutrients_list, "Sugar"),
-        }
-        
-        # Add the original food name for the front end log
-        nutrition_data['food_name'] = info_data.get('name', food_name)
-        
-        logger.info(f"Returning API nutrition data for: {food_name}")
-        return jsonify(nutrition_data), 200
+        if not isinstance(food_names, list) or not food_names:
+            return jsonify({"error": "A non-empty list of food names is required"}), 400
+        if len(food_names) > MAX_BATCH_LOOKUPS:
+            return jsonify({"error": f"At most {MAX_BATCH_LOOKUPS} food names can be looked up per request"}), 400
+
+        results = [None] * len(food_names)
+        pending = {}
+
+        for i, name in enumerate(food_names):
+            if not isinstance(name, str):
+                results[i] = {"error": "Food name must be a string"}
+                continue
+
+            food_name = name.strip()
+            if not food_name:
+                results[i] = {"error": "Food name is required"}
+                continue
+
+            nutrition_data = lookup_local_nutrition(food_name)
+            if nutrition_data is not None:
+                results[i] = nutrition_data
+            else:
+                pending[i] = LOOKUP_EXECUTOR.submit(lookup_api_nutrition, food_name)
+
+        for i, future in pending.items():
+            payload, _ = future.result()
+            results[i] = payload
+
+        return jsonify({'results': results}), 200
 
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Spoonacular API call failed during lookup: {str(e)}")
-        # Check if e has a response object before accessing status_code
-        status_code = getattr(e.response, 'status_code', 500)
-        if status_code in [401, 402, 403]:
-            return jsonify({"error": "Spoonacular API Key Invalid or Quota Exceeded. Please check your key."}), status_code
-        return jsonify({"error": f"API Connection Error: {e}"}), 500
     except Exception as e:
-        logger.error(f"Error during nutrition lookup: {str(e)}")
+        logger.error(f"Error during batch nutrition lookup: {str(e)}")
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
 
@@ -478,13 +799,8 @@ def calculate_health_metrics():
         if not all([age, height, weight, gender, activity]):
             return jsonify({'error': 'Missing required health metrics'}), 400
 
-        if gender == 'male':
-            bmr = (10 * weight) + (6.25 * height) - (5 * age) + 5
-        else:
-            bmr = (10 * weight) + (6.25 * height) - (5 * age) - 161
-
-        activity_multipliers = {1: 1.2, 2: 1.375, 3: 1.55, 4: 1.725, 5: 1.9}
-        tdee = bmr * activity_multipliers.get(activity, 1.2)
+        bmr = (10 * weight) + (6.25 * height) - (5 * age) + GENDER_BMR_OFFSET.get(gender, DEFAULT_BMR_OFFSET)
+        tdee = bmr * ACTIVITY_MULTIPLIERS[int(activity) if activity in ACTIVITY_LEVELS else 0]
         bmi = weight / ((height / 100) ** 2)
 
         results = {
@@ -501,8 +817,53 @@ def calculate_health_metrics():
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
 
-if __name__ == '__main__':
-    # Call the new loading function on startup to ingest the local JSON dataset
+@app.route('/calculate_health_metrics_batch', methods=['POST'])
+def calculate_health_metrics_batch():
+    """
+    Batch version of /calculate_health_metrics for many profiles at once.
+    Takes equal-length lists for age, height, weight, gender and activity, and
+    returns a list per metric in the same order, computed with NumPy in one pass.
+    """
+    try:
+        data = request.get_json()
+        fields = ['age', 'height', 'weight', 'gender', 'activity']
+        columns = [data.get(field) for field in fields]
+
+        if not all(isinstance(column, list) and column for column in columns):
+            return jsonify({'error': 'Missing required health metrics'}), 400
+        if len({len(column) for column in columns}) != 1:
+            return jsonify({'error': 'All health metric lists must have the same length'}), 400
+        if not all(all(column) for column in columns):
+            return jsonify({'error': 'Missing required health metrics'}), 400
+
+        age, height, weight = (np.asarray(column, dtype=np.float64) for column in columns[:3])
+        gender = np.asarray(columns[3])
+
+        bmr = (10 * weight) + (6.25 * height) - (5 * age) + np.where(gender == 'male', GENDER_BMR_OFFSET['male'], DEFAULT_BMR_OFFSET)
+
+        # Unknown activity levels (including strings like '3') fall back to index 0, which
+        # holds the default multiplier; checked per element exactly like the scalar endpoint
+        activity_idx = np.array([int(a) if a in ACTIVITY_LEVELS else 0 for a in columns[4]])
+        tdee = bmr * ACTIVITY_MULTIPLIER_LUT[activity_idx]
+        bmi = weight / ((height / 100) ** 2)
+
+        results = {
+            'bmi': np.round(bmi, 1).tolist(),
+            'calories_maintain': np.round(tdee, 0).tolist(),
+            'calories_mild_loss': np.round(tdee - 250, 0).tolist(),
+            'calories_weight_loss': np.round(tdee - 500, 0).tolist(),
+            'calories_extreme_loss': np.round(tdee - 750, 0).tolist(),
+        }
+        return jsonify(results), 200
+
+    except Exception as e:
+        logger.error(f"Error calculating batch health metrics: {str(e)}")
+        return jsonify({'error': f'Internal server error: {str(e)}'}), 500
+
+
+# Load the dataset on import, so every process serving the app has it; this covers
+# WSGI servers such as gunicorn (see gunicorn.conf.py) as well as `python app.py`
+if LOCAL_DATASET is None:
     load_local_dataset()
     
     # Check and log the final state of the local dataset after startup
@@ -511,7 +872,11 @@ if __name__ == '__main__':
     else:
         logger.error("Local Data Status: FAILED. API fallback is mandatory for all requests.")
         
-    if API_KEY == "4bab931c1e9b4b71880d69188f321e55":
-        logger.warning("WARNING: Using default/placeholder API key. API calls may fail.")
+if API_KEY == "4bab931c1e9b4b71880d69188f321e55":
+    logger.warning("WARNING: Using default/placeholder API key. API calls may fail.")
+
+
+if __name__ == '__main__':
+    # Development server only; in production run `gunicorn app:app` from this directory
     port = int(os.getenv('FLASK_PORT', 5000))
-    app.run(host='0.0.0.0', port=port, debug=True)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=port, debug=True)
@@ -0,0 +1,16 @@
+# Production server config, picked up automatically by `gunicorn app:app`
+# when run from the backend directory.
+import os
+
+bind = f"0.0.0.0:{os.getenv('FLASK_PORT', 5000)}"
+
+# A single process with many threads: OCR jobs, the Spoonacular cache and the
+# local dataset all live in process memory, so extra worker processes would
+# not see each other's OCR jobs. Tesseract, OpenCV and network I/O release the
+# GIL, so threads still serve independent requests in parallel.
+workers = 1
+worker_class = "gthread"
+threads = 16
+
+# OCR on large images can take a few seconds
+timeout = 60